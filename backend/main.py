@@ -2,17 +2,34 @@
 Weather Data Analytics Backend (offline-first)
 Serves data from local storage/HDFS without calling external weather APIs.
 """
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, date
-from statistics import mean
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from statistics import fmean
+from typing import Any, Dict, Iterable, Iterator, List, Literal, Optional
 
+import orjson
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, field_validator
 
+from cache import TTLCache
 from storage import get_storage_adapter
 
-app = FastAPI(title="Weather Analytics API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release cached file handles / flush pending writes on shutdown
+    storage.close()
+
+
+app = FastAPI(
+    title="Weather Analytics API",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # CORS for frontend
 app.add_middleware(
@@ -26,6 +43,19 @@ app.add_middleware(
 # Initialize storage adapter (HDFS or local fallback)
 storage = get_storage_adapter()
 
+# Only fields needed by the numeric endpoints (/stats, /forecast)
+NUMERIC_FIELDS = ["timestamp", "tempC", "humidity", "windKph"]
+
+# Records per chunk sent by the NDJSON streaming endpoints; each chunk is one
+# threadpool hop and one ASGI send, so per-record chunks are costly
+NDJSON_BATCH = 256
+
+# Latest record per city for /weather?mode=current; invalidated on ingest
+_current_cache = TTLCache(maxsize=2048, ttl=600)
+
+# Filtered record lists keyed by query arguments; cleared on ingest
+_records_cache = TTLCache(maxsize=32, ttl=30)
+
 
 # Data Models
 class WeatherRecord(BaseModel):
@@ -36,6 +66,12 @@ class WeatherRecord(BaseModel):
     windKph: Optional[float] = None
     conditions: Optional[str] = None
 
+    @field_validator("city")
+    @classmethod
+    def _strip_city(cls, value: str) -> str:
+        # City names key the partition files; stray whitespace would split them
+        return value.strip()
+
 
 class IngestRequest(BaseModel):
     records: List[WeatherRecord]
@@ -45,32 +81,32 @@ def _parse_timestamp(ts: str) -> Optional[datetime]:
     """Parse ISO timestamps while tolerating missing timezone suffixes."""
     if not ts or not isinstance(ts, str):
         return None
+    return _parse_iso_timestamp(ts)
+
+
+@lru_cache(maxsize=131072)
+def _parse_iso_timestamp(ts: str) -> Optional[datetime]:
+    """Memoized parser; the same stored timestamps are re-parsed on every request."""
     try:
-        # Handle formats like "2025-11-17T23:00" (no timezone)
-        if "T" in ts and "+" not in ts and "Z" not in ts:
-            return datetime.fromisoformat(ts)
-        # Handle UTC with Z
-        if ts.endswith("Z"):
-            return datetime.fromisoformat(ts.replace("Z", "+00:00"))
-        # Standard ISO format
+        # Python 3.11+ accepts naive values, offsets and a trailing "Z" directly
         return datetime.fromisoformat(ts)
-    except Exception:
+    except ValueError:
         return None
 
 
-def _filter_by_range(
-    records: List[Dict[str, Any]],
+def _iter_in_range(
+    records: Iterable[Dict[str, Any]],
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-) -> List[Dict[str, Any]]:
-    """Filter records by optional inclusive start/end dates (YYYY-MM-DD)."""
+) -> Iterator[Dict[str, Any]]:
+    """Yield records within optional inclusive start/end dates (YYYY-MM-DD)."""
     if not start_date and not end_date:
-        return records
+        yield from records
+        return
 
     start_dt = datetime.fromisoformat(start_date) if start_date else None
     end_dt = datetime.fromisoformat(end_date) + timedelta(days=1) if end_date else None
 
-    filtered: List[Dict[str, Any]] = []
     for rec in records:
         ts = rec.get("timestamp")
         parsed = _parse_timestamp(ts) if isinstance(ts, str) else None
@@ -80,8 +116,64 @@ def _filter_by_range(
             continue
         if end_dt and parsed >= end_dt:
             continue
-        filtered.append(rec)
-    return filtered
+        yield rec
+
+
+def _filter_by_range(
+    records: List[Dict[str, Any]],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Filter records by optional inclusive start/end dates (YYYY-MM-DD)."""
+    if not start_date and not end_date:
+        return records
+    return list(_iter_in_range(records, start_date, end_date))
+
+
+def _normalize_city(city: Optional[str]) -> Optional[str]:
+    """Storage keys cities case-insensitively; strip and lowercase once per request."""
+    return (city.strip().lower() or None) if city else None
+
+
+def _require_city(city: str) -> str:
+    """Normalize a required city; a blank one must not widen the query to all cities."""
+    normalized = _normalize_city(city)
+    if normalized is None:
+        raise HTTPException(status_code=400, detail="City is required")
+    return normalized
+
+
+def _records_key(
+    city: Optional[str],
+    days: Optional[int],
+    start: Optional[str],
+    end: Optional[str],
+    fields: Optional[List[str]],
+) -> tuple:
+    """Hashable _records_cache key for a (normalized) query."""
+    return (city, days, start, end, tuple(fields) if fields else None)
+
+
+def _storage_query(
+    city: Optional[str],
+    days: Optional[int],
+    start: Optional[str],
+    end: Optional[str],
+    fields: Optional[List[str]],
+) -> Dict[str, Any]:
+    """Translate endpoint filters into storage iter_records/read_records arguments."""
+    # Storage prunes partitions outside [start, end]; rows are still checked by the caller
+    return {
+        "city": city,
+        "since": datetime.now() - timedelta(days=days) if days else None,
+        "fields": fields,
+        # Match _iter_in_range: rows from start up to (not including) end + 1 day,
+        # so the last partition is the date of the instant just before that bound
+        "start": datetime.fromisoformat(start).date() if start else None,
+        "end": (
+            datetime.fromisoformat(end) + timedelta(days=1) - timedelta(microseconds=1)
+        ).date() if end else None,
+    }
 
 
 def _read_records(
@@ -89,12 +181,59 @@ def _read_records(
     days: Optional[int] = None,
     start: Optional[str] = None,
     end: Optional[str] = None,
+    fields: Optional[List[str]] = None,
 ) -> List[Dict[str, Any]]:
     """Centralized record retrieval with optional city/days/date-range filtering."""
-    since = datetime.now() - timedelta(days=days) if days else None
-    records = storage.read_records(city=city, since=since)
+    # The same normalized value keys the cache and drives the storage read
+    city = _normalize_city(city)
+    key = _records_key(city, days, start, end, fields)
+    cached = _records_cache.get(key)
+    if cached is not None:
+        # Hand out a copy so callers can sort without touching the cached list
+        return list(cached)
+
+    # Taken before the read: an ingest landing mid-read must not leave stale records cached
+    generation = _records_cache.generation
+    records = storage.read_records(**_storage_query(city, days, start, end, fields))
     records = _filter_by_range(records, start_date=start, end_date=end)
-    return records
+    _records_cache.set(key, records, generation)
+    return list(records)
+
+
+def _iter_records(
+    city: Optional[str],
+    days: Optional[int] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Like _read_records, but streams from storage for single-pass consumers.
+    Reuses a list _read_records cached for the same query; never fills the cache.
+    """
+    city = _normalize_city(city)
+    cached = _records_cache.get(_records_key(city, days, start, end, fields))
+    if cached is not None:
+        return iter(cached)
+    records = storage.iter_records(**_storage_query(city, days, start, end, fields))
+    return _iter_in_range(records, start_date=start, end_date=end)
+
+
+def _ndjson_chunks(records: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """Encode records as NDJSON, NDJSON_BATCH lines per yielded chunk."""
+    batch: List[bytes] = []
+    for rec in records:
+        batch.append(orjson.dumps(rec, default=str))
+        if len(batch) >= NDJSON_BATCH:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def _ndjson_response(records: Iterable[Dict[str, Any]]) -> StreamingResponse:
+    """Stream records one JSON document per line instead of a single array."""
+    return StreamingResponse(_ndjson_chunks(records), media_type="application/x-ndjson")
 
 
 @app.get("/health")
@@ -108,14 +247,14 @@ async def health():
 
 
 @app.get("/cities")
-async def list_cities():
+def list_cities():
     """Return unique city names from available data files."""
     cities = storage.list_cities()
     return {"count": len(cities), "cities": cities}
 
 
 @app.post("/ingest")
-async def ingest_weather(data: IngestRequest):
+def ingest_weather(data: IngestRequest):
     """
     Ingest weather records into storage (HDFS or local)
     Accepts array of WeatherRecord objects
@@ -124,10 +263,21 @@ async def ingest_weather(data: IngestRequest):
         raise HTTPException(status_code=400, detail="No records provided")
 
     try:
-        stored_count = 0
+        # Store each (city, timestamp) once per batch; later duplicates are dropped
+        seen = set()
+        records = []
         for record in data.records:
-            storage.write_record(record.dict())
-            stored_count += 1
+            key = (record.city.lower(), record.timestamp)
+            if key in seen:
+                continue
+            seen.add(key)
+            records.append(record.model_dump())
+        storage.write_records(records)
+        stored_count = len(records)
+
+        _records_cache.clear()
+        for record in records:
+            _current_cache.pop(record["city"].lower())
 
         return {
             "message": f"Successfully ingested {stored_count} records",
@@ -138,12 +288,11 @@ async def ingest_weather(data: IngestRequest):
 
 
 @app.get("/weather")
-async def get_weather(
+def get_weather(
     city: str = Query(..., description="City name"),
-    mode: str = Query(
+    mode: Literal["current", "past", "historical"] = Query(
         "current",
         description="Retrieval mode: current, past, historical",
-        regex="^(current|past|historical)$",
     ),
     days: int = Query(365, description="Past days (mode=past)"),
     start: Optional[str] = Query(None, description="Start date YYYY-MM-DD (historical)"),
@@ -155,24 +304,25 @@ async def get_weather(
     - past: returns records within the last N days
     - historical: returns records within an explicit date range
     """
+    # Storage keys cities case-insensitively; normalize once per request
+    city = _require_city(city)
     try:
         if mode == "current":
-            records = _read_records(city=city, days=None)
-            if not records:
-                raise HTTPException(status_code=404, detail="No stored records for this city")
-            # Sort by parsed timestamp to ensure correct chronological order
-            latest = sorted(
-                records,
-                key=lambda x: _parse_timestamp(x.get("timestamp", "")) or datetime.min,
-                reverse=True
-            )[0]
-            return {"city": city.lower(), "record": latest, "mode": "current"}
+            latest = _current_cache.get(city)
+            if latest is None:
+                generation = _current_cache.generation
+                latest = storage.get_latest(city)
+                if not latest:
+                    raise HTTPException(status_code=404, detail="No stored records for this city")
+                # Skipped if an ingest invalidated the cache while we were reading
+                _current_cache.set(city, latest, generation)
+            return {"city": city, "record": latest, "mode": "current"}
 
         if mode == "past":
             records = _read_records(city=city, days=max(1, days))
             if not records:
                 raise HTTPException(status_code=404, detail="No stored records for requested window")
-            return {"city": city.lower(), "stored": len(records), "mode": "past", "records": records}
+            return {"city": city, "stored": len(records), "mode": "past", "records": records}
 
         if mode == "historical":
             if not start or not end:
@@ -184,7 +334,7 @@ async def get_weather(
             if not records:
                 raise HTTPException(status_code=404, detail="No stored records in this date range")
             return {
-                "city": city.lower(),
+                "city": city,
                 "stored": len(records),
                 "mode": "historical",
                 "start": start,
@@ -199,8 +349,41 @@ async def get_weather(
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.get("/weather/stream")
+def stream_weather(
+    city: str = Query(..., description="City name"),
+    mode: Literal["past", "historical"] = Query(
+        "past",
+        description="Retrieval mode: past, historical",
+    ),
+    days: int = Query(365, description="Past days (mode=past)"),
+    start: Optional[str] = Query(None, description="Start date YYYY-MM-DD (historical)"),
+    end: Optional[str] = Query(None, description="End date YYYY-MM-DD (historical)"),
+):
+    """
+    Stream past/historical records for a city as newline-delimited JSON.
+    """
+    city = _require_city(city)
+    if mode == "historical" and (not start or not end):
+        raise HTTPException(
+            status_code=400,
+            detail="Start and end dates are required for historical mode",
+        )
+
+    try:
+        # No sort needed: stream rows as storage yields them instead of building the list
+        if mode == "past":
+            records = _iter_records(city=city, days=max(1, days))
+        else:
+            records = _iter_records(city=city, start=start, end=end)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    return _ndjson_response(records)
+
+
 @app.get("/stats")
-async def get_stats(
+def get_stats(
     city: Optional[str] = Query(None, description="Filter by city"),
     days: Optional[int] = Query(365, description="Number of days to analyze; omit for all"),
     start: Optional[str] = Query(None, description="Start date YYYY-MM-DD"),
@@ -209,10 +392,35 @@ async def get_stats(
     """
     Get statistics (averages, min, max) for stored records.
     """
+    city = _normalize_city(city)
     try:
-        records = _read_records(city=city, days=days, start=start, end=end)
-
-        if not records:
+        # Projected lists are small and cached, so repeated dashboard polls skip storage
+        records = _read_records(city=city, days=days, start=start, end=end, fields=NUMERIC_FIELDS)
+        record_count = len(records)
+
+        # Single pass over the records, no intermediate value lists
+        n_temp = n_hum = n_wind = 0
+        sum_temp = sum_hum = sum_wind = 0.0
+        min_temp = max_temp = None
+        for r in records:
+            temp = r.get("tempC")
+            if isinstance(temp, (int, float)):
+                n_temp += 1
+                sum_temp += temp
+                if min_temp is None or temp < min_temp:
+                    min_temp = temp
+                if max_temp is None or temp > max_temp:
+                    max_temp = temp
+            hum = r.get("humidity")
+            if isinstance(hum, (int, float)):
+                n_hum += 1
+                sum_hum += hum
+            wind = r.get("windKph")
+            if isinstance(wind, (int, float)):
+                n_wind += 1
+                sum_wind += wind
+
+        if not record_count:
             return {
                 "city": city or "all",
                 "period_days": days,
@@ -224,29 +432,22 @@ async def get_stats(
                 "max_tempC": None,
             }
 
-        temps = [r.get("tempC") for r in records if isinstance(r.get("tempC"), (int, float))]
-        hums = [r.get("humidity") for r in records if isinstance(r.get("humidity"), (int, float))]
-        winds = [r.get("windKph") for r in records if isinstance(r.get("windKph"), (int, float))]
-
-        def avg(values: List[float]) -> Optional[float]:
-            return sum(values) / len(values) if values else None
-
         return {
             "city": city or "all",
             "period_days": days,
-            "record_count": len(records),
-            "avg_tempC": round(avg(temps), 2) if temps else None,
-            "avg_humidity": round(avg(hums), 2) if hums else None,
-            "avg_windKph": round(avg(winds), 2) if winds else None,
-            "min_tempC": round(min(temps), 2) if temps else None,
-            "max_tempC": round(max(temps), 2) if temps else None,
+            "record_count": record_count,
+            "avg_tempC": round(sum_temp / n_temp, 2) if n_temp else None,
+            "avg_humidity": round(sum_hum / n_hum, 2) if n_hum else None,
+            "avg_windKph": round(sum_wind / n_wind, 2) if n_wind else None,
+            "min_tempC": round(min_temp, 2) if n_temp else None,
+            "max_tempC": round(max_temp, 2) if n_temp else None,
         }
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.get("/history")
-async def get_history(
+def get_history(
     city: Optional[str] = Query(None, description="Filter by city"),
     days: Optional[int] = Query(365, description="Number of days of history; omit for all"),
     start: Optional[str] = Query(None, description="Start date YYYY-MM-DD"),
@@ -255,6 +456,7 @@ async def get_history(
     """
     Get stored weather records.
     """
+    city = _normalize_city(city)
     try:
         records = _read_records(city=city, days=days, start=start, end=end)
         records.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
@@ -269,6 +471,26 @@ async def get_history(
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@app.get("/history/stream")
+def stream_history(
+    city: Optional[str] = Query(None, description="Filter by city"),
+    days: Optional[int] = Query(365, description="Number of days of history; omit for all"),
+    start: Optional[str] = Query(None, description="Start date YYYY-MM-DD"),
+    end: Optional[str] = Query(None, description="End date YYYY-MM-DD"),
+):
+    """
+    Stream stored weather records as newline-delimited JSON (newest first).
+    """
+    city = _normalize_city(city)
+    try:
+        records = _read_records(city=city, days=days, start=start, end=end)
+        records.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    return _ndjson_response(records)
+
+
 def _parse_iso_date(ts: str) -> Optional[date]:
     parsed = _parse_timestamp(ts)
     return parsed.date() if parsed else None
@@ -280,30 +502,33 @@ def _average_forecast(values: List[float], periods: int) -> List[float]:
         return [None] * periods
 
     # Calculate average of all historical values
-    avg_value = sum(values) / len(values)
+    avg_value = fmean(values)
     
     # Return the same average for all forecast periods
     return [round(avg_value, 2)] * periods
 
 
 def generate_forecast(city: str, days: int, lookback: int) -> Dict[str, Any]:
-    records = storage.read_records(city=city, since=None)
+    records = _read_records(city=city, fields=NUMERIC_FIELDS)
     if not records:
         raise HTTPException(status_code=404, detail="No stored data available for forecast")
 
+    # Running [sum, count] per metric per day; means are taken once per day below
     daily_map: Dict[date, Dict[str, List[float]]] = {}
     for rec in records:
         ts = rec.get("timestamp")
         record_date = _parse_iso_date(ts) if isinstance(ts, str) else None
         if not record_date:
             continue
-        daily = daily_map.setdefault(record_date, {"temp": [], "humid": [], "wind": []})
-        if isinstance(rec.get("tempC"), (int, float)):
-            daily["temp"].append(float(rec["tempC"]))
-        if isinstance(rec.get("humidity"), (int, float)):
-            daily["humid"].append(float(rec["humidity"]))
-        if isinstance(rec.get("windKph"), (int, float)):
-            daily["wind"].append(float(rec["windKph"]))
+        daily = daily_map.get(record_date)
+        if daily is None:
+            daily = daily_map[record_date] = {"temp": [0.0, 0], "humid": [0.0, 0], "wind": [0.0, 0]}
+        for key, field in (("temp", "tempC"), ("humid", "humidity"), ("wind", "windKph")):
+            value = rec.get(field)
+            if isinstance(value, (int, float)):
+                acc = daily[key]
+                acc[0] += value
+                acc[1] += 1
 
     if not daily_map:
         raise HTTPException(status_code=404, detail="Insufficient numeric data for forecast")
@@ -311,22 +536,20 @@ def generate_forecast(city: str, days: int, lookback: int) -> Dict[str, Any]:
     daily_dates = sorted(daily_map.keys())
     daily_dates = daily_dates[-lookback:]
 
-    temp_series: List[float] = []
-    humid_series: List[float] = []
-    wind_series: List[float] = []
+    series: Dict[str, List[float]] = {"temp": [], "humid": [], "wind": []}
     for d in daily_dates:
-        entry = daily_map[d]
-        if entry["temp"]:
-            temp_series.append(round(mean(entry["temp"]), 2))
-        if entry["humid"]:
-            humid_series.append(round(mean(entry["humid"]), 2))
-        if entry["wind"]:
-            wind_series.append(round(mean(entry["wind"]), 2))
+        for key, (total, count) in daily_map[d].items():
+            if count:
+                series[key].append(round(total / count, 2))
+    temp_series = series["temp"]
+    humid_series = series["humid"]
+    wind_series = series["wind"]
 
     if len(temp_series) < 1 and len(humid_series) < 1 and len(wind_series) < 1:
         raise HTTPException(status_code=400, detail="Need at least one day of data for prediction")
 
-    today = datetime.now().date()
+    now = datetime.now()
+    today = now.date()
     tomorrow = today + timedelta(days=1)
     future_dates = [tomorrow + timedelta(days=i) for i in range(days)]
 
@@ -334,20 +557,14 @@ def generate_forecast(city: str, days: int, lookback: int) -> Dict[str, Any]:
     humid_forecast = _average_forecast(humid_series, days) if humid_series else [None] * days
     wind_forecast = _average_forecast(wind_series, days) if wind_series else [None] * days
 
-    forecast = []
-    for idx, day_date in enumerate(future_dates):
-        forecast.append(
-            {
-                "date": day_date.isoformat(),
-                "tempC": temp_forecast[idx],
-                "humidity": humid_forecast[idx],
-                "windKph": wind_forecast[idx],
-            }
-        )
+    forecast = [
+        {"date": day_date.isoformat(), "tempC": temp, "humidity": humid, "windKph": wind}
+        for day_date, temp, humid, wind in zip(future_dates, temp_forecast, humid_forecast, wind_forecast)
+    ]
 
     return {
         "city": city.lower(),
-        "generated_at": datetime.now().isoformat(),
+        "generated_at": now.isoformat(),
         "lookback_days": len(daily_dates),
         "forecast_days": days,
         "data": forecast,
@@ -355,7 +572,7 @@ def generate_forecast(city: str, days: int, lookback: int) -> Dict[str, Any]:
 
 
 @app.get("/forecast")
-async def get_forecast(
+def get_forecast(
     city: str = Query(..., description="City to forecast"),
     days: int = Query(5, description="Days ahead to forecast (2-7)", ge=2, le=7),
     lookback: int = Query(30, description="Number of historical days to use for calculation", ge=3),
@@ -364,6 +581,7 @@ async def get_forecast(
     Predict upcoming days using average-based calculation from stored records.
     Uses historical average values for prediction.
     """
+    city = _require_city(city)
     try:
         return generate_forecast(city, days, lookback)
     except HTTPException:
@@ -373,6 +591,12 @@ async def get_forecast(
 
 
 if __name__ == "__main__":
+    import os
+
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    # Multiple workers require the import string; a single worker serves this
+    # module's app directly instead of importing main (and its storage) again
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    target = "main:app" if workers > 1 else app
+    uvicorn.run(target, host="0.0.0.0", port=5000, workers=workers)